@@ -15,24 +15,68 @@ from utils.utils import *
 
 
 class DOLPHIN:
-    def __init__(self, model_id_or_path):
+    def __init__(self, model_id_or_path, torch_compile=False, bf16=False):
         """Initialize the Hugging Face model
         
         Args:
             model_id_or_path: Path to local model or Hugging Face model ID
+            torch_compile: Compile the vision encoder with torch.compile
+            bf16: Run in bfloat16 instead of float16 on GPUs that support it
         """
+        # Set device and precision (fp16 on GPU unless bf16 is requested, fp32 on CPU)
+        self.device, self.dtype = select_device_and_dtype(bf16)
+
         # Load model from local path or Hugging Face hub
         self.processor = AutoProcessor.from_pretrained(model_id_or_path)
-        self.model = VisionEncoderDecoderModel.from_pretrained(model_id_or_path)
+        self.model = VisionEncoderDecoderModel.from_pretrained(model_id_or_path, torch_dtype=self.dtype)
         self.model.eval()
-        
-        # Set device and precision
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model.to(self.device)
-        self.model = self.model.half()  # Always use half precision by default
+
+        # The encoder always sees the processor's fixed input size, so it compiles to a stable graph;
+        # the decoder stays eager because its growing KV cache would keep triggering recompilation
+        if torch_compile:
+            self.model.encoder = torch.compile(self.model.encoder)
+            self._warm_up_encoder((1,))
         
         # set tokenizer
         self.tokenizer = self.processor.tokenizer
+        self._prompt_ids_cache = {}  # prompt text -> tokenized ids on self.device
+
+    def _warm_up_encoder(self, batch_sizes):
+        """Run the compiled encoder on dummy inputs so compilation happens at load time instead of on the first image
+
+        Args:
+            batch_sizes: Batch sizes to compile for
+        """
+        size = self.processor.image_processor.size
+        with torch.no_grad():
+            for batch_size in batch_sizes:
+                pixel_values = torch.zeros(
+                    batch_size, 3, size["height"], size["width"], device=self.device, dtype=self.dtype
+                )
+                # Same arguments generate() passes to the encoder, so the guards match the real calls
+                self.model.encoder(
+                    pixel_values=pixel_values, output_attentions=False, output_hidden_states=False, return_dict=True
+                )
+
+    def _encode_prompt(self, prompt):
+        """Tokenize a prompt once and reuse its ids (already on the device) on later calls
+
+        Args:
+            prompt: Text prompt without the <s> / <Answer/> wrapping
+
+        Returns:
+            Prompt ids tensor of shape (1, prompt_length)
+        """
+        prompt_ids = self._prompt_ids_cache.get(prompt)
+        if prompt_ids is None:
+            prompt_ids = self.tokenizer(
+                f"<s>{prompt} <Answer/>",
+                add_special_tokens=False,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            self._prompt_ids_cache[prompt] = prompt_ids
+        return prompt_ids
         
     def chat(self, prompt, image):
         """Process an image with the given prompt
@@ -46,21 +90,16 @@ class DOLPHIN:
         """
         # Prepare image
         pixel_values = self.processor(image, return_tensors="pt").pixel_values
-        pixel_values = pixel_values.half()
+        pixel_values = pixel_values.to(self.device, dtype=self.dtype)
             
         # Prepare prompt
-        prompt = f"<s>{prompt} <Answer/>"
-        prompt_ids = self.tokenizer(
-            prompt, 
-            add_special_tokens=False, 
-            return_tensors="pt"
-        ).input_ids.to(self.device)
+        prompt_ids = self._encode_prompt(prompt)
         
         decoder_attention_mask = torch.ones_like(prompt_ids)
         
         # Generate text
         outputs = self.model.generate(
-            pixel_values=pixel_values.to(self.device),
+            pixel_values=pixel_values,
             decoder_input_ids=prompt_ids,
             decoder_attention_mask=decoder_attention_mask,
             min_length=1,
@@ -74,9 +113,9 @@ class DOLPHIN:
             num_beams=1,
         )
         
-        # Process the output
-        sequence = self.tokenizer.batch_decode(outputs.sequences, skip_special_tokens=False)[0]
-        sequence = sequence.replace(prompt, "").replace("<pad>", "").replace("</s>", "").strip()
+        # Process the output: drop the prompt tokens by position and let the tokenizer skip <pad> and </s>
+        generated_ids = outputs.sequences[:, prompt_ids.shape[1]:]
+        sequence = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0].strip()
         
         return sequence
 
@@ -144,10 +183,20 @@ def main():
         help="Directory to save parsing results (default: same as input directory)",
     )
     parser.add_argument("--print_results", action="store_true", help="Print recognition results to console")
+    parser.add_argument(
+        "--torch_compile",
+        action="store_true",
+        help="Compile the vision encoder with torch.compile (slower startup, faster inference)",
+    )
+    parser.add_argument(
+        "--bf16",
+        action="store_true",
+        help="Run in bfloat16 instead of float16 on GPUs that support it (may change the parsed text)",
+    )
     args = parser.parse_args()
     
     # Load Model
-    model = DOLPHIN(args.model_path)
+    model = DOLPHIN(args.model_path, torch_compile=args.torch_compile, bf16=args.bf16)
     
     # Set save directory
     save_dir = args.save_dir or (
@@ -6,8 +6,12 @@ SPDX-License-Identifier: MIT
 import argparse
 import glob
 import os
+from itertools import groupby
+
+# Crop batches vary in size from call to call; expandable segments keep the CUDA caching allocator from
+# fragmenting over them. Must be set before torch is imported; an existing user setting wins.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
 
-import cv2
 import torch
 from PIL import Image
 from transformers import AutoProcessor, VisionEncoderDecoderModel
@@ -16,31 +20,77 @@ from utils.utils import *
 
 
 class DOLPHIN:
-    def __init__(self, model_id_or_path):
+    def __init__(self, model_id_or_path, torch_compile=False, bf16=False):
         """Initialize the Hugging Face model
         
         Args:
             model_id_or_path: Path to local model or Hugging Face model ID
+            torch_compile: Compile the vision encoder with torch.compile
+            bf16: Run in bfloat16 instead of float16 on GPUs that support it
         """
+        # Set device and precision (fp16 on GPU unless bf16 is requested, fp32 on CPU)
+        self.device, self.dtype = select_device_and_dtype(bf16)
+
         # Load model from local path or Hugging Face hub
         self.processor = AutoProcessor.from_pretrained(model_id_or_path)
-        self.model = VisionEncoderDecoderModel.from_pretrained(model_id_or_path)
+        self.model = VisionEncoderDecoderModel.from_pretrained(model_id_or_path, torch_dtype=self.dtype)
         self.model.eval()
-        
-        # Set device and precision
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model.to(self.device)
-        self.model = self.model.half()  # Always use half precision by default
+
+        # The encoder always sees the processor's fixed input size, so it compiles to a stable graph;
+        # the decoder stays eager because its growing KV cache would keep triggering recompilation
+        if torch_compile:
+            self.model.encoder = torch.compile(self.model.encoder)
+            self._warm_up_encoder((1, 2))
         
         # set tokenizer
         self.tokenizer = self.processor.tokenizer
+        self._prompt_ids_cache = {}  # prompt text -> tokenized ids on self.device
+
+    def _warm_up_encoder(self, batch_sizes):
+        """Run the compiled encoder on dummy inputs so compilation happens at load time instead of on the first image
+
+        Args:
+            batch_sizes: Batch sizes to compile for
+        """
+        # Batch size 1 gets its own specialized graph; the second size makes dynamo compile a graph with a
+        # dynamic batch dimension that covers every later element batch
+        size = self.processor.image_processor.size
+        with torch.no_grad():
+            for batch_size in batch_sizes:
+                pixel_values = torch.zeros(
+                    batch_size, 3, size["height"], size["width"], device=self.device, dtype=self.dtype
+                )
+                # Same arguments generate() passes to the encoder, so the guards match the real calls
+                self.model.encoder(
+                    pixel_values=pixel_values, output_attentions=False, output_hidden_states=False, return_dict=True
+                )
+
+    def _encode_prompt(self, prompt):
+        """Tokenize a prompt once and reuse its ids (already on the device) on later calls
+
+        Args:
+            prompt: Text prompt without the <s> / <Answer/> wrapping
+
+        Returns:
+            Prompt ids tensor of shape (1, prompt_length)
+        """
+        prompt_ids = self._prompt_ids_cache.get(prompt)
+        if prompt_ids is None:
+            prompt_ids = self.tokenizer(
+                f"<s>{prompt} <Answer/>",
+                add_special_tokens=False,
+                return_tensors="pt"
+            ).input_ids.to(self.device)
+            self._prompt_ids_cache[prompt] = prompt_ids
+        return prompt_ids
         
     def chat(self, prompt, image):
         """Process an image or batch of images with the given prompt(s)
         
         Args:
-            prompt: Text prompt or list of prompts to guide the model
-            image: PIL Image or list of PIL Images to process
+            prompt: Text prompt, or list of identical prompts, to guide the model
+            image: PIL Image / RGB numpy array, or a list of them, to process
             
         Returns:
             Generated text or list of texts from the model
@@ -59,18 +109,14 @@ class DOLPHIN:
         
         # Prepare image
         batch_inputs = self.processor(images, return_tensors="pt", padding=True)
-        batch_pixel_values = batch_inputs.pixel_values.half().to(self.device)
+        batch_pixel_values = batch_inputs.pixel_values.to(self.device, dtype=self.dtype)
         
-        # Prepare prompt
-        prompts = [f"<s>{p} <Answer/>" for p in prompts]
-        batch_prompt_inputs = self.tokenizer(
-            prompts,
-            add_special_tokens=False,
-            return_tensors="pt"
-        )
-
-        batch_prompt_ids = batch_prompt_inputs.input_ids.to(self.device)
-        batch_attention_mask = batch_prompt_inputs.attention_mask.to(self.device)
+        # Prepare prompt: reuse the cached ids, no tokenization or padding needed
+        if len(set(prompts)) != 1:
+            # Padding a shorter prompt would shift the decoder's positions, and generate() drops the mask
+            raise ValueError("All images in a batch must share one prompt")
+        batch_prompt_ids = self._encode_prompt(prompts[0]).repeat(len(images), 1)
+        batch_attention_mask = torch.ones_like(batch_prompt_ids)
         
         # Generate text
         outputs = self.model.generate(
@@ -89,14 +135,11 @@ class DOLPHIN:
             repetition_penalty=1.1
         )
         
-        # Process output
-        sequences = self.tokenizer.batch_decode(outputs.sequences, skip_special_tokens=False)
-        
-        # Clean prompt text from output
-        results = []
-        for i, sequence in enumerate(sequences):
-            cleaned = sequence.replace(prompts[i], "").replace("<pad>", "").replace("</s>", "").strip()
-            results.append(cleaned)
+        # Process output: drop the prompt tokens by position instead of string matching,
+        # and let the tokenizer skip <pad> and </s>
+        generated_ids = outputs.sequences[:, batch_prompt_ids.shape[1]:]
+        sequences = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+        results = [sequence.strip() for sequence in sequences]
             
         # Return a single result for single image input
         if not is_batch:
@@ -124,23 +167,28 @@ def process_elements(layout_results, padded_image, dims, model, max_batch_size=N
     """Parse all document elements with parallel decoding"""
     layout_results = parse_layout_string(layout_results)
 
-    # Store text and table elements separately
-    text_elements = []  # Text elements
-    table_elements = []  # Table elements
+    # Binarize the page once; every element's edge adjustment reads from it
+    binary = binarize_image(padded_image)
+
+    # Channel-reversed view of the whole page: crops taken from it are RGB without any copy,
+    # and the processor accepts them as numpy arrays in one batched call
+    rgb_image = padded_image[:, :, ::-1]
+
+    text_table_elements = []  # Text and table elements, batched per prompt
     figure_results = []  # Image elements (no processing needed)
     previous_box = None
     reading_order = 0
 
-    # Collect elements to process and group by type
+    # Collect elements to process
     for bbox, label in layout_results:
         try:
             # Adjust coordinates
             x1, y1, x2, y2, orig_x1, orig_y1, orig_x2, orig_y2, previous_box = process_coordinates(
-                bbox, padded_image, dims, previous_box
+                bbox, padded_image, dims, previous_box, binary
             )
 
             # Crop and parse element
-            cropped = padded_image[y1:y2, x1:x2]
+            cropped = rgb_image[y1:y2, x1:x2]
             if cropped.size > 0:
                 if label == "fig":
                     # For figure regions, add empty text result immediately
@@ -153,20 +201,17 @@ def process_elements(layout_results, padded_image, dims, model, max_batch_size=N
                         }
                     )
                 else:
-                    # Prepare element for parsing
-                    pil_crop = Image.fromarray(cv2.cvtColor(cropped, cv2.COLOR_BGR2RGB))
-                    element_info = {
-                        "crop": pil_crop,
-                        "label": label,
-                        "bbox": [orig_x1, orig_y1, orig_x2, orig_y2],
-                        "reading_order": reading_order,
-                    }
-                    
-                    # Group by type
-                    if label == "tab":
-                        table_elements.append(element_info)
-                    else:  # Text elements
-                        text_elements.append(element_info)
+                    # Prepare element for parsing, each with its own prompt
+                    prompt = "Parse the table in the image." if label == "tab" else "Read text in the image."
+                    text_table_elements.append(
+                        {
+                            "crop": cropped,
+                            "prompt": prompt,
+                            "label": label,
+                            "bbox": [orig_x1, orig_y1, orig_x2, orig_y2],
+                            "reading_order": reading_order,
+                        }
+                    )
 
             reading_order += 1
 
@@ -177,15 +222,10 @@ def process_elements(layout_results, padded_image, dims, model, max_batch_size=N
     # Initialize results list
     recognition_results = figure_results.copy()
     
-    # Process text elements (in batches)
-    if text_elements:
-        text_results = process_element_batch(text_elements, model, "Read text in the image.", max_batch_size)
-        recognition_results.extend(text_results)
-    
-    # Process table elements (in batches)
-    if table_elements:
-        table_results = process_element_batch(table_elements, model, "Parse the table in the image.", max_batch_size)
-        recognition_results.extend(table_results)
+    # Process text and table elements (batches are split where the prompt changes)
+    if text_table_elements:
+        element_results = process_element_batch(text_table_elements, model, max_batch_size)
+        recognition_results.extend(element_results)
 
     # Sort elements by reading order
     recognition_results.sort(key=lambda x: x.get("reading_order", 0))
@@ -193,36 +233,42 @@ def process_elements(layout_results, padded_image, dims, model, max_batch_size=N
     return recognition_results
 
 
-def process_element_batch(elements, model, prompt, max_batch_size=None):
-    """Process elements of the same type in batches"""
+def process_element_batch(elements, model, max_batch_size=None):
+    """Process elements in batches, each batch holding elements with the same prompt"""
     results = []
-    
-    # Determine batch size
-    batch_size = len(elements)
-    if max_batch_size is not None and max_batch_size > 0:
-        batch_size = min(batch_size, max_batch_size)
-    
-    # Process in batches
-    for i in range(0, len(elements), batch_size):
-        batch_elements = elements[i:i+batch_size]
-        crops_list = [elem["crop"] for elem in batch_elements]
-        
-        # Use the same prompt for all elements in the batch
-        prompts_list = [prompt] * len(crops_list)
-        
-        # Batch inference
-        batch_results = model.chat(prompts_list, crops_list)
-        
-        # Add results
-        for j, result in enumerate(batch_results):
-            elem = batch_elements[j]
-            results.append({
-                "label": elem["label"],
-                "bbox": elem["bbox"],
-                "text": result.strip(),
-                "reading_order": elem["reading_order"],
-            })
-    
+
+    # Group elements with the same prompt and similar crop size so each batch decodes to similar lengths;
+    # results are put back in reading order by the caller
+    elements = sorted(elements, key=lambda elem: (elem["prompt"], elem["crop"].shape[0] * elem["crop"].shape[1]))
+
+    # Batches never mix prompts: a left-padded prompt would shift the decoder's learned positions, and
+    # generate() rebuilds the decoder attention mask, so padding cannot be masked out
+    for prompt, group_iter in groupby(elements, key=lambda elem: elem["prompt"]):
+        group = list(group_iter)
+
+        # Determine batch size
+        batch_size = len(group)
+        if max_batch_size is not None and max_batch_size > 0:
+            batch_size = min(batch_size, max_batch_size)
+
+        # Process in batches
+        for i in range(0, len(group), batch_size):
+            batch_elements = group[i:i+batch_size]
+            crops_list = [elem["crop"] for elem in batch_elements]
+
+            # Batch inference
+            batch_results = model.chat(prompt, crops_list)
+
+            # Add results
+            for j, result in enumerate(batch_results):
+                elem = batch_elements[j]
+                results.append({
+                    "label": elem["label"],
+                    "bbox": elem["bbox"],
+                    "text": result.strip(),
+                    "reading_order": elem["reading_order"],
+                })
+
     return results
 
 
@@ -242,10 +288,20 @@ def main():
         default=16,
         help="Maximum number of document elements to parse in a single batch (default: 16)",
     )
+    parser.add_argument(
+        "--torch_compile",
+        action="store_true",
+        help="Compile the vision encoder with torch.compile (slower startup, faster inference)",
+    )
+    parser.add_argument(
+        "--bf16",
+        action="store_true",
+        help="Run in bfloat16 instead of float16 on GPUs that support it (may change the parsed text)",
+    )
     args = parser.parse_args()
 
     # Load Model
-    model = DOLPHIN(args.model_path)
+    model = DOLPHIN(args.model_path, torch_compile=args.torch_compile, bf16=args.bf16)
 
     # Collect Document Images
     if os.path.isdir(args.input_path):
@@ -20,13 +20,28 @@ from typing import List, Dict, Any, Optional
 """
 
 
+# Patterns used by extract_table_from_html and MarkdownConverter._post_process, compiled once per process
+_TABLE_PATTERN = re.compile(r'<table.*?>.*?</table>', re.DOTALL)
+_TABLE_OPEN_TAG_PATTERN = re.compile(r'<table[^>]*>')
+_AUTHOR_PATTERN = re.compile(r'\\author\{(.*?)\}', re.DOTALL)
+_MATH_AUTHOR_PATTERN = re.compile(r'\$(\\author\{.*?\})\$', re.DOTALL)
+_ABSTRACT_ENV_PATTERN = re.compile(r'\\begin\{abstract\}(.*?)\\end\{abstract\}', re.DOTALL)
+_ABSTRACT_BEGIN_PATTERN = re.compile(r'\\begin\{abstract\}')
+_EQNO_PATTERN = re.compile(r'\\eqno\{\((.*?)\)\}')
+_LATEX_FIXES = [
+    # Fix spacing issues in subscripts and superscripts
+    (re.compile(r'_ {'), r'_{'),
+    (re.compile(r'^ {'), r'^{'),
+
+    # Fix potential issues with multiple consecutive newlines
+    (re.compile(r'\n{3,}'), r'\n\n'),
+]
+
+
 def extract_table_from_html(html_string):
     """Extract and clean table tags from HTML string"""
     try:
-        table_pattern = re.compile(r'<table.*?>.*?</table>', re.DOTALL)
-        tables = table_pattern.findall(html_string)
-        tables = [re.sub(r'<table[^>]*>', '<table>', table) for table in tables]
-        return '\n'.join(tables)
+        return '\n'.join(_TABLE_OPEN_TAG_PATTERN.sub('<table>', table) for table in _TABLE_PATTERN.findall(html_string))
     except Exception as e:
         print(f"extract_table_from_html error: {str(e)}")
         return f"<table><tr><td>Error extracting table: {str(e)}</td></tr></table>"
@@ -248,7 +263,8 @@ class MarkdownConverter:
         """
         try:
             markdown_content = []
-            if '<table' in text.lower() or '<tr' in text.lower():
+            lowered = text.lower()
+            if '<table' in lowered or '<tr' in lowered:
                 markdown_table = extract_table_from_html(text)
                 markdown_content.append(markdown_table + "\n")
             else:
@@ -375,8 +391,6 @@ class MarkdownConverter:
         """
         try:
             # Handle author information
-            author_pattern = re.compile(r'\\author\{(.*?)\}', re.DOTALL)
-            
             def process_author_match(match):
                 # Extract author content
                 author_content = match.group(1)
@@ -384,16 +398,15 @@ class MarkdownConverter:
                 return self._handle_text(author_content)
             
             # Replace \author{...} with processed content
-            markdown_content = author_pattern.sub(process_author_match, markdown_content)
+            markdown_content = _AUTHOR_PATTERN.sub(process_author_match, markdown_content)
             
             # Handle special case where author is inside math environment
-            math_author_pattern = re.compile(r'\$(\\author\{.*?\})\$', re.DOTALL)
-            match = math_author_pattern.search(markdown_content)
+            match = _MATH_AUTHOR_PATTERN.search(markdown_content)
             if match:
                 # Extract the author command
                 author_cmd = match.group(1)
                 # Extract content from author command
-                author_content_match = re.search(r'\\author\{(.*?)\}', author_cmd, re.DOTALL)
+                author_content_match = _AUTHOR_PATTERN.search(author_cmd)
                 if author_content_match:
                     # Get author content and process it
                     author_content = author_content_match.group(1)
@@ -402,20 +415,13 @@ class MarkdownConverter:
                     markdown_content = markdown_content.replace(match.group(0), processed_content)
             
             # Replace LaTeX abstract environment with plain text
-            markdown_content = re.sub(r'\\begin\{abstract\}(.*?)\\end\{abstract\}', 
-                                     r'**Abstract** \1', 
-                                     markdown_content, 
-                                     flags=re.DOTALL)
+            markdown_content = _ABSTRACT_ENV_PATTERN.sub(r'**Abstract** \1', markdown_content)
             
             # Replace standalone \begin{abstract} (without matching end)
-            markdown_content = re.sub(r'\\begin\{abstract\}', 
-                                     r'**Abstract**', 
-                                     markdown_content)
+            markdown_content = _ABSTRACT_BEGIN_PATTERN.sub(r'**Abstract**', markdown_content)
             
             # Replace LaTeX equation numbers with tag format, handling cases with extra backslashes
-            markdown_content = re.sub(r'\\eqno\{\((.*?)\)\}',
-                                    r'\\tag{\1}',
-                                    markdown_content)
+            markdown_content = _EQNO_PATTERN.sub(r'\\tag{\1}', markdown_content)
 
             # Find the starting tag of the formula
             markdown_content = markdown_content.replace("\[ \\\\", "$$ \\\\")
@@ -424,17 +430,8 @@ class MarkdownConverter:
             markdown_content = markdown_content.replace("\\\\ \]", "\\\\ $$")
 
             # Fix other common LaTeX issues
-            replacements = [
-                # Fix spacing issues in subscripts and superscripts
-                (r'_ {', r'_{'),
-                (r'^ {', r'^{'),
-                
-                # Fix potential issues with multiple consecutive newlines
-                (r'\n{3,}', r'\n\n')
-            ]
-            
-            for old, new in replacements:
-                markdown_content = re.sub(old, new, markdown_content)
+            for pattern, new in _LATEX_FIXES:
+                markdown_content = pattern.sub(new, markdown_content)
             
             return markdown_content
         except Exception as e:
@@ -10,12 +10,10 @@ import re
 from dataclasses import dataclass
 from typing import List, Tuple
 
-import albumentations as alb
 import cv2
 import numpy as np
-from albumentations.pytorch import ToTensorV2
+import torch
 from PIL import Image
-from timm.data.constants import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD
 from torchvision.transforms.functional import resize
 
 from utils.markdown_utils import MarkdownConverter
@@ -28,14 +26,47 @@ def alb_wrapper(transform):
     return f
 
 
-test_transform = alb_wrapper(
-    alb.Compose(
-        [
-            alb.Normalize(IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD),
-            ToTensorV2(),
-        ]
-    )
-)
+_test_transform = None
+
+
+def test_transform(im):
+    """Normalize an image for the Swin encoder
+
+    albumentations and timm are only needed by the config-based framework, so the
+    pipeline is built on first use instead of at import time.
+    """
+    global _test_transform
+    if _test_transform is None:
+        import albumentations as alb
+        from albumentations.pytorch import ToTensorV2
+        from timm.data.constants import IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD
+
+        _test_transform = alb_wrapper(
+            alb.Compose(
+                [
+                    alb.Normalize(IMAGENET_DEFAULT_MEAN, IMAGENET_DEFAULT_STD),
+                    ToTensorV2(),
+                ]
+            )
+        )
+    return _test_transform(im)
+
+
+def select_device_and_dtype(bf16=False):
+    """Pick the inference device and the matching model precision
+
+    Args:
+        bf16: Use bfloat16 instead of float16 on GPUs that support it
+
+    Returns:
+        tuple: (device, dtype) - float16 on GPU (bfloat16 when requested and supported),
+        float32 on CPU where half precision kernels are slow or missing
+    """
+    if not torch.cuda.is_available():
+        return "cpu", torch.float32
+    if bf16 and torch.cuda.is_bf16_supported():
+        return "cuda", torch.bfloat16
+    return "cuda", torch.float16
 
 
 def check_coord_valid(x1, y1, x2, y2, image_size=None, abs_coord=True):
@@ -53,23 +84,33 @@ def check_coord_valid(x1, y1, x2, y2, image_size=None, abs_coord=True):
     return True, None
 
     
-def adjust_box_edges(image, boxes: List[List[float]], max_pixels=15, threshold=0.2):
+def binarize_image(image):
+    """Inverted Otsu binarization of a BGR image, used to snap box edges to text"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary
+
+
+def adjust_box_edges(image, boxes: List[List[float]], max_pixels=15, threshold=0.2, binary=None):
     """
     Image: cv2.image object, or Path
     Input: boxes: list of boxes [[x1, y1, x2, y2]]. Using absolute coordinates.
+    binary: optional result of binarize_image(image), for callers adjusting boxes of the same image repeatedly
     """
     if isinstance(image, str):
         image = cv2.imread(image)
     img_h, img_w = image.shape[:2]
+
+    # The Otsu binarization depends only on the image, so compute it once rather than per edge step
+    if binary is None:
+        binary = binarize_image(image)
+
     new_boxes = []
     for box in boxes:
         best_box = copy.deepcopy(box)
 
-        def check_edge(img, current_box, i, is_vertical):
+        def check_edge(binary, current_box, i, is_vertical):
             edge = current_box[i]
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-
             if is_vertical:
                 line = binary[current_box[1] : current_box[3] + 1, edge]
             else:
@@ -89,7 +130,7 @@ def adjust_box_edges(image, boxes: List[List[float]], max_pixels=15, threshold=0
         current_box[3] = min(max(current_box[3], 0), img_h - 1)
 
         for i, direction, is_vertical in edges:
-            best_score = check_edge(image, current_box, i, is_vertical)
+            best_score = check_edge(binary, current_box, i, is_vertical)
             if best_score <= threshold:
                 continue
             for step in range(max_pixels):
@@ -98,7 +139,7 @@ def adjust_box_edges(image, boxes: List[List[float]], max_pixels=15, threshold=0
                     current_box[i] = min(max(current_box[i], 0), img_w - 1)
                 else:
                     current_box[i] = min(max(current_box[i], 0), img_h - 1)
-                score = check_edge(image, current_box, i, is_vertical)
+                score = check_edge(binary, current_box, i, is_vertical)
 
                 if score < best_score:
                     best_score = score
@@ -111,10 +152,12 @@ def adjust_box_edges(image, boxes: List[List[float]], max_pixels=15, threshold=0
     return new_boxes
 
 
+_LAYOUT_PATTERN = re.compile(r"\[(\d*\.?\d+),\s*(\d*\.?\d+),\s*(\d*\.?\d+),\s*(\d*\.?\d+)\]\s*(\w+)")
+
+
 def parse_layout_string(bbox_str):
     """Parse layout string using regular expressions"""
-    pattern = r"\[(\d*\.?\d+),\s*(\d*\.?\d+),\s*(\d*\.?\d+),\s*(\d*\.?\d+)\]\s*(\w+)"
-    matches = re.finditer(pattern, bbox_str)
+    matches = _LAYOUT_PATTERN.finditer(bbox_str)
 
     parsed_results = []
     for match in matches:
@@ -181,7 +224,7 @@ def map_to_relevant_coordinates(abs_coords, dims: ImageDimensions):
         return 0.0, 0.0, 1.0, 1.0  # Return full image coordinates
 
 
-def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_box=None):
+def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_box=None, binary=None):
     """Process and adjust coordinates
     
     Args:
@@ -189,6 +232,7 @@ def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_bo
         padded_image: Padded image
         dims: Image dimensions object
         previous_box: Previous box coordinates for overlap adjustment
+        binary: Optional binarize_image(padded_image), computed once per page by the caller
     
     Returns:
         tuple: (x1, y1, x2, y2, orig_x1, orig_y1, orig_x2, orig_y2, new_previous_box)
@@ -211,7 +255,7 @@ def process_coordinates(coords, padded_image, dims: ImageDimensions, previous_bo
             y2 = min(y1 + 1, dims.padded_h)
         
         # Extend box boundaries
-        new_boxes = adjust_box_edges(padded_image, [[x1, y1, x2, y2]])
+        new_boxes = adjust_box_edges(padded_image, [[x1, y1, x2, y2]], binary=binary)
         x1, y1, x2, y2 = new_boxes[0]
         
         # Ensure coordinates are still within image bounds after adjustment